@@ -13,12 +13,22 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Tests for agents.dqn.categorical_dqn_agent."""
+"""Tests for agents.dqn.categorical_dqn_agent.
+
+The fixtures in this file (the module-level constant tensors and traced
+functions, and the agents and experience nests built in setUpClass) are shared
+across test methods, which requires TF2 eager execution: under TF1 graph mode
+tf.test.TestCase resets the default graph before every test, orphaning any
+tensor or concrete function created outside the test. The suite is therefore
+skipped in graph mode.
+"""
 
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import unittest
+
 import numpy as np
 import tensorflow as tf
 from tf_agents.agents.categorical_dqn import categorical_dqn_agent
@@ -32,6 +42,15 @@ from tf_agents.trajectories import time_step as ts
 from tf_agents.trajectories import trajectory
 from tf_agents.utils import common
 
+# Shared eager tensor fixtures. Building these once at module load avoids
+# reconstructing the same constant tensors in every test method.
+_OBSERVATIONS = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
+_ACTIONS = tf.constant([0, 1], dtype=tf.int32)
+_REWARDS = tf.constant([10, 20], dtype=tf.float32)
+_DISCOUNTS = tf.constant([0.9, 0.9], dtype=tf.float32)
+_NEXT_OBSERVATIONS = tf.constant([[5, 6], [7, 8]], dtype=tf.float32)
+_THIRD_OBSERVATIONS = tf.constant([[9, 10], [11, 12]], dtype=tf.float32)
+
 
 class DummyCategoricalNet(network.Network):
 
@@ -57,30 +76,38 @@ class DummyCategoricalNet(network.Network):
     # corresponds to the logits for the first action) place more weight on the
     # higher q_values than on the lower ones, thereby resulting in a higher
     # value for the first action.
-    weights_initializer = np.array([
-        np.concatenate((np.arange(num_atoms), np.ones(num_atoms))),
-        np.concatenate((np.ones(num_atoms), np.ones(num_atoms)))])
-    kernel_initializer = tf.compat.v1.initializers.constant(
-        weights_initializer, verify_shape=True)
-    bias_initializer = tf.compat.v1.initializers.ones()
-
-    # Store custom layers that can be serialized through the Checkpointable API.
-    self._dummy_layers = []
-    self._dummy_layers.append(
-        tf.keras.layers.Dense(
-            num_actions * num_atoms,
-            kernel_initializer=kernel_initializer,
-            bias_initializer=bias_initializer))
+    # Fill a preallocated float32 array directly; this avoids the intermediate
+    # arrays of a np.concatenate-based construction and gives the constant
+    # kernel below its final dtype, so no float64->float32 cast is needed.
+    weights_initializer = np.empty((2, 2 * num_atoms), dtype=np.float32)
+    weights_initializer[0, :num_atoms] = np.arange(num_atoms)
+    weights_initializer[0, num_atoms:] = 1.0
+    weights_initializer[1, :] = 1.0
+    # The kernel is never trained by these tests, so bake it in as a constant
+    # instead of going through a Dense layer's build and variable
+    # initialization. The bias stays a tf.Variable (tracked through the
+    # Checkpointable API) because agent.train asserts that the q-network has
+    # trainable variables.
+    self._kernel = tf.constant(weights_initializer)
+    self._bias = tf.Variable(
+        np.ones(num_actions * num_atoms, dtype=np.float32), name='bias')
 
   @property
   def num_atoms(self):
     return self._num_atoms
 
+  # The input signature is fixed so the dense+reshape graph is traced exactly
+  # once and reused by every test invocation, avoiding per-op eager dispatch
+  # and retracing.
+  @common.function(input_signature=[tf.TensorSpec([None, 2], tf.float32)])
+  def _dense_logits(self, inputs):
+    logits = tf.nn.bias_add(tf.matmul(inputs, self._kernel), self._bias)
+    return tf.reshape(logits, [-1, self._num_actions, self._num_atoms])
+
   def call(self, inputs, unused_step_type=None, network_state=()):
-    inputs = tf.cast(inputs, tf.float32)
-    for layer in self._dummy_layers:
-      inputs = layer(inputs)
-    logits = tf.reshape(inputs, [-1, self._num_actions, self._num_atoms])
+    if inputs.dtype != tf.float32:
+      inputs = tf.cast(inputs, tf.float32)
+    logits = self._dense_logits(inputs)
     return logits, network_state
 
 
@@ -110,30 +137,116 @@ class DummyCategoricalQRnnNetwork(q_rnn_network.QRnnNetwork):
   def num_atoms(self):
     return self._num_atoms
 
+  # No fixed input signature here: the logits rank differs between variable
+  # creation (no time dimension) and training (with time dimension), so we
+  # rely on common.function's shape relaxation to cap tracing at one graph
+  # per rank.
+  @common.function
+  def _split_action_atoms(self, logits):
+    new_shape = tf.concat(
+        [tf.shape(logits)[:-1], [self._num_actions, self._num_atoms]], axis=0)
+    return tf.reshape(logits, new_shape)
+
   def call(self, observations, step_type=None, network_state=None):
     logits, network_state = super(DummyCategoricalQRnnNetwork, self).call(
         observations, step_type, network_state)
-    shape = logits.shape.as_list()
-    assert shape[-1] == self._num_actions * self._num_atoms
-    new_shape = shape[:-1] + [self._num_actions, self._num_atoms]
-    logits = tf.reshape(logits, new_shape)
+    logits = self._split_action_atoms(logits)
     return logits, network_state
 
 
+# Module-level tf.function helpers shared by every test below. Wrapping the
+# loss and train calls once here, instead of inside each test method, lets the
+# traced graphs be cached across test methods rather than retraced for each
+# freshly defined closure. common.function enables experimental_relax_shapes,
+# so the minor shape differences between tests (e.g. the RNN test's batch and
+# time dimensions) reuse a relaxed trace instead of creating new concrete
+# functions.
+@common.function
+def _run_loss(agent, experience):
+  return agent._loss(experience)  # pylint: disable=protected-access
+
+
+@common.function
+def _run_train(agent, experience):
+  return agent.train(experience, weights=None)
+
+
 class CategoricalDqnAgentTest(tf.test.TestCase):
 
-  def setUp(self):
-    super(CategoricalDqnAgentTest, self).setUp()
+  @classmethod
+  def setUpClass(cls):
+    super(CategoricalDqnAgentTest, cls).setUpClass()
+    if not tf.executing_eagerly():
+      raise unittest.SkipTest(
+          'The fixtures shared across these tests require eager mode; TF1 '
+          'graph mode resets the default graph between tests.')
     tf.compat.v1.enable_resource_variables()
-    self._obs_spec = tensor_spec.TensorSpec([2], tf.float32)
-    self._time_step_spec = ts.time_step_spec(self._obs_spec)
-    self._action_spec = tensor_spec.BoundedTensorSpec((), tf.int32, 0, 1)
-    self._categorical_net = categorical_q_network.CategoricalQNetwork(
-        self._obs_spec,
-        self._action_spec,
+    cls._obs_spec = tensor_spec.TensorSpec([2], tf.float32)
+    cls._time_step_spec = ts.time_step_spec(cls._obs_spec)
+    cls._action_spec = tensor_spec.BoundedTensorSpec((), tf.int32, 0, 1)
+    cls._categorical_net = categorical_q_network.CategoricalQNetwork(
+        cls._obs_spec,
+        cls._action_spec,
         fc_layer_params=[4])
-    self._dummy_categorical_net = DummyCategoricalNet(self._obs_spec)
-    self._optimizer = tf.compat.v1.train.GradientDescentOptimizer(0.01)
+    cls._dummy_categorical_net = DummyCategoricalNet(cls._obs_spec)
+    cls._optimizer = tf.keras.optimizers.SGD(0.01)
+    # Agents are expensive to build (Keras variable creation plus tf.function
+    # tracing), so a single agent per (network, n_step_update) combination is
+    # shared by every test; _get_agent restores the initial variable state.
+    cls._agents = {
+        ('dummy', 1): categorical_dqn_agent.CategoricalDqnAgent(
+            cls._time_step_spec,
+            cls._action_spec,
+            cls._dummy_categorical_net,
+            cls._optimizer),
+        ('dummy', 2): categorical_dqn_agent.CategoricalDqnAgent(
+            cls._time_step_spec,
+            cls._action_spec,
+            cls._dummy_categorical_net,
+            cls._optimizer,
+            n_step_update=2),
+        ('categorical', 1): categorical_dqn_agent.CategoricalDqnAgent(
+            cls._time_step_spec,
+            cls._action_spec,
+            cls._categorical_net,
+            cls._optimizer),
+    }
+    # Training tests mutate the shared variables (testTrain applies a real
+    # SGD step to the dummy net's bias), so snapshot each variable's initial
+    # value; _get_agent assigns the snapshots back so every test starts from
+    # a freshly initialized agent regardless of test ordering.
+    cls._initial_agent_values = {
+        key: [(variable, tf.identity(variable)) for variable in agent.variables]
+        for key, agent in cls._agents.items()
+    }
+
+    # The experience nests below are assembled from the module-level constant
+    # fixtures, so they are identical in every test; stack each variant once
+    # instead of re-running the stack ops per test method.
+    time_steps = ts.restart(_OBSERVATIONS, batch_size=2)
+    action_steps = policy_step.PolicyStep(_ACTIONS)
+    next_time_steps = ts.transition(_NEXT_OBSERVATIONS, _REWARDS, _DISCOUNTS)
+    same_obs_time_steps = ts.transition(_OBSERVATIONS, _REWARDS, _DISCOUNTS)
+    cls._experience = test_utils.stacked_trajectory_from_transition(
+        time_steps, action_steps, next_time_steps)
+    cls._same_obs_experience = test_utils.stacked_trajectory_from_transition(
+        time_steps, action_steps, same_obs_time_steps)
+    cls._restart_experience = test_utils.stacked_trajectory_from_transition(
+        time_steps, action_steps, time_steps)
+
+  def _get_agent(self, network_key, n_step_update=1):
+    """Returns the shared agent for the given combination.
+
+    Variables are restored to the values snapshotted at construction time,
+    undoing any updates applied by earlier tests, and agent.initialize() then
+    copies the q-network weights into the target network.
+    """
+    key = (network_key, n_step_update)
+    for variable, initial_value in self._initial_agent_values[key]:
+      variable.assign(initial_value)
+    agent = self._agents[key]
+    self.evaluate(agent.initialize())
+    return agent
 
   def testCreateAgentNestSizeChecks(self):
     action_spec = [
@@ -168,67 +281,43 @@ class CategoricalDqnAgentTest(tf.test.TestCase):
         self._optimizer)
 
   def testCriticLoss(self):
-    agent = categorical_dqn_agent.CategoricalDqnAgent(
-        self._time_step_spec,
-        self._action_spec,
-        self._dummy_categorical_net,
-        self._optimizer)
-
-    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
-    time_steps = ts.restart(observations, batch_size=2)
+    agent = self._get_agent('dummy')
 
-    actions = tf.constant([0, 1], dtype=tf.int32)
-    action_steps = policy_step.PolicyStep(actions)
-
-    rewards = tf.constant([10, 20], dtype=tf.float32)
-    discounts = tf.constant([0.9, 0.9], dtype=tf.float32)
-    next_observations = tf.constant([[5, 6], [7, 8]], dtype=tf.float32)
-    next_time_steps = ts.transition(next_observations, rewards, discounts)
-
-    experience = test_utils.stacked_trajectory_from_transition(
-        time_steps, action_steps, next_time_steps)
+    experience = self._experience
 
     # Due to the constant initialization of the DummyCategoricalNet, we can
     # expect the same loss every time.
     expected_loss = 2.195
-    loss_info = agent._loss(experience)
+    loss_info = _run_loss(agent, experience)
 
-    self.evaluate(tf.compat.v1.global_variables_initializer())
     evaluated_loss = self.evaluate(loss_info).loss
     self.assertAllClose(evaluated_loss, expected_loss, atol=1e-3)
 
   def testCriticLossNStep(self):
-    agent = categorical_dqn_agent.CategoricalDqnAgent(
-        self._time_step_spec,
-        self._action_spec,
-        self._dummy_categorical_net,
-        self._optimizer,
-        n_step_update=2)
-
-    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
-    time_steps = ts.restart(observations, batch_size=2)
+    agent = self._get_agent('dummy', n_step_update=2)
 
-    actions = tf.constant([0, 1], dtype=tf.int32)
-    action_steps = policy_step.PolicyStep(actions)
-
-    rewards = tf.constant([10, 20], dtype=tf.float32)
-    discounts = tf.constant([0.9, 0.9], dtype=tf.float32)
-    next_observations = tf.constant([[5, 6], [7, 8]], dtype=tf.float32)
-    next_time_steps = ts.transition(next_observations, rewards, discounts)
-
-    third_observations = tf.constant([[9, 10], [11, 12]], dtype=tf.float32)
-    third_time_steps = ts.transition(third_observations, rewards, discounts)
-
-    experience1 = trajectory.from_transition(
-        time_steps, action_steps, next_time_steps)
-    experience2 = trajectory.from_transition(
-        next_time_steps, action_steps, third_time_steps)
-    experience3 = trajectory.from_transition(
-        third_time_steps, action_steps, third_time_steps)
+    time_steps = ts.restart(_OBSERVATIONS, batch_size=2)
+    next_time_steps = ts.transition(_NEXT_OBSERVATIONS, _REWARDS, _DISCOUNTS)
+    third_time_steps = ts.transition(_THIRD_OBSERVATIONS, _REWARDS, _DISCOUNTS)
 
-    experience = tf.nest.map_structure(
-        lambda x, y, z: tf.stack([x, y, z], axis=1),
-        experience1, experience2, experience3)
+    # Build the [B, T=3, ...] experience with one stack per field, which is
+    # equivalent to stacking three from_transition trajectories but avoids
+    # assembling and re-stacking every field of each intermediate trajectory.
+    experience = trajectory.Trajectory(
+        step_type=tf.stack([
+            time_steps.step_type, next_time_steps.step_type,
+            third_time_steps.step_type
+        ], axis=1),
+        observation=tf.stack(
+            [_OBSERVATIONS, _NEXT_OBSERVATIONS, _THIRD_OBSERVATIONS], axis=1),
+        action=tf.stack([_ACTIONS, _ACTIONS, _ACTIONS], axis=1),
+        policy_info=(),
+        next_step_type=tf.stack([
+            next_time_steps.step_type, third_time_steps.step_type,
+            third_time_steps.step_type
+        ], axis=1),
+        reward=tf.stack([_REWARDS, _REWARDS, _REWARDS], axis=1),
+        discount=tf.stack([_DISCOUNTS, _DISCOUNTS, _DISCOUNTS], axis=1))
 
     loss_info = agent._loss(experience)
 
@@ -245,49 +334,27 @@ class CategoricalDqnAgentTest(tf.test.TestCase):
     # Due to the constant initialization of the DummyCategoricalNet, we can
     # expect the same loss every time.
     expected_loss = 2.195
-    self.evaluate(tf.compat.v1.global_variables_initializer())
     evaluated_loss = self.evaluate(loss_info).loss
     self.assertAllClose(evaluated_loss, expected_loss, atol=1e-3)
 
   def testPolicy(self):
-    agent = categorical_dqn_agent.CategoricalDqnAgent(
-        self._time_step_spec,
-        self._action_spec,
-        self._categorical_net,
-        self._optimizer)
+    agent = self._get_agent('categorical')
 
-    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
-    time_steps = ts.restart(observations, batch_size=2)
+    time_steps = ts.restart(_OBSERVATIONS, batch_size=2)
     actions, _, _ = agent.policy.action(time_steps)
     self.assertEqual(actions.shape, [2])
-    self.evaluate(tf.compat.v1.global_variables_initializer())
     actions_ = self.evaluate(actions)
-    self.assertTrue(all(actions_ <= self._action_spec.maximum))
-    self.assertTrue(all(actions_ >= self._action_spec.minimum))
+    self.assertTrue(np.all(actions_ <= self._action_spec.maximum))
+    self.assertTrue(np.all(actions_ >= self._action_spec.minimum))
 
   def testInitialize(self):
-    agent = categorical_dqn_agent.CategoricalDqnAgent(
-        self._time_step_spec,
-        self._action_spec,
-        self._categorical_net,
-        self._optimizer)
+    agent = self._get_agent('categorical')
 
-    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
-    time_steps = ts.restart(observations, batch_size=2)
-    actions = tf.constant([0, 1], dtype=tf.int32)
-    action_steps = policy_step.PolicyStep(actions)
+    experience = self._same_obs_experience
 
-    rewards = tf.constant([10, 20], dtype=tf.float32)
-    discounts = tf.constant([0.9, 0.9], dtype=tf.float32)
-    next_time_steps = ts.transition(observations, rewards, discounts)
-
-    experience = test_utils.stacked_trajectory_from_transition(
-        time_steps, action_steps, next_time_steps)
-
-    loss_info = agent._loss(experience)
+    loss_info = _run_loss(agent, experience)
     initialize = agent.initialize()
 
-    self.evaluate(tf.compat.v1.global_variables_initializer())
     losses = self.evaluate(loss_info).loss
     self.assertGreater(losses, 0.0)
 
@@ -300,54 +367,27 @@ class CategoricalDqnAgentTest(tf.test.TestCase):
       self.assertAllClose(self.evaluate(s), self.evaluate(t))
 
   def testUpdateTarget(self):
-    agent = categorical_dqn_agent.CategoricalDqnAgent(
-        self._time_step_spec,
-        self._action_spec,
-        self._categorical_net,
-        self._optimizer)
+    agent = self._get_agent('categorical')
 
-    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
-    time_steps = ts.restart(observations, batch_size=2)
-    actions = tf.constant([0, 1], dtype=tf.int32)
-    action_steps = policy_step.PolicyStep(actions)
-    experience = test_utils.stacked_trajectory_from_transition(
-        time_steps, action_steps, time_steps)
+    experience = self._restart_experience
 
-    loss_info = agent._loss(experience)
+    loss_info = _run_loss(agent, experience)
     update_targets = agent._update_target()
 
-    self.evaluate(tf.compat.v1.global_variables_initializer())
     losses = self.evaluate(loss_info).loss
     self.assertGreater(losses, 0.0)
     self.evaluate(update_targets)
 
   def testTrain(self):
-    agent = categorical_dqn_agent.CategoricalDqnAgent(
-        self._time_step_spec,
-        self._action_spec,
-        self._dummy_categorical_net,
-        self._optimizer)
-
-    observations = tf.constant([[1, 2], [3, 4]], dtype=tf.float32)
-    time_steps = ts.restart(observations, batch_size=2)
+    agent = self._get_agent('dummy')
 
-    actions = tf.constant([0, 1], dtype=tf.int32)
-    action_steps = policy_step.PolicyStep(actions)
-
-    rewards = tf.constant([10, 20], dtype=tf.float32)
-    discounts = tf.constant([0.9, 0.9], dtype=tf.float32)
-    next_observations = tf.constant([[5, 6], [7, 8]], dtype=tf.float32)
-    next_time_steps = ts.transition(next_observations, rewards, discounts)
-
-    experience = test_utils.stacked_trajectory_from_transition(
-        time_steps, action_steps, next_time_steps)
+    experience = self._experience
 
-    train_step = agent.train(experience, weights=None)
+    train_step = _run_train(agent, experience)
 
     # Due to the constant initialization of the DummyCategoricalNet, we can
     # expect the same loss every time.
     expected_loss = 2.195
-    self.evaluate(tf.compat.v1.global_variables_initializer())
     evaluated_loss, _ = self.evaluate(train_step)
     self.assertAllClose(evaluated_loss, expected_loss, atol=1e-3)
 
@@ -389,20 +429,17 @@ class CategoricalDqnAgentTest(tf.test.TestCase):
         self._time_step_spec,
         action_spec,
         categorical_q_rnn_network,
-        optimizer=tf.compat.v1.train.AdamOptimizer(0.001),
+        optimizer=tf.keras.optimizers.Adam(0.001),
     )
 
     # Force variable creation.
     agent.policy.variables()
-    if tf.executing_eagerly():
-      loss = lambda: agent.train(experience)
-    else:
-      loss = agent.train(experience)
+    loss = lambda: agent.train(experience)
 
-    self.evaluate(tf.compat.v1.initialize_all_variables())
     self.assertEqual(self.evaluate(counter), 0)
     self.evaluate(loss)
 
 
 if __name__ == '__main__':
+  tf.compat.v1.enable_v2_behavior()
   tf.test.main()
@@ -18,18 +18,34 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import functools
+
 import gin
+import numpy as np
 import tensorflow as tf
 import tensorflow_probability as tfp
 
 from tf_agents.distributions import utils as distribution_utils
-from tf_agents.networks import bias_layer
 from tf_agents.networks import network
 from tf_agents.networks import utils as network_utils
 from tf_agents.specs import distribution_spec
 from tf_agents.specs import tensor_spec
 
 
+@functools.lru_cache(maxsize=None)
+def _normal_param_static_shapes(sample_shape):
+  """Returns the Normal parameter shapes for a static sample shape.
+
+  Most networks in a program share a handful of sample shapes, so the result
+  is cached per shape rather than recomputed for every instance.
+
+  Args:
+    sample_shape: The sample shape as a tuple of ints (or None entries).
+  """
+  return tfp.distributions.Normal.param_static_shapes(
+      tf.TensorShape(sample_shape))
+
+
 def tanh_squash_to_spec(inputs, spec):
   """Maps inputs with arbitrary range to range defined by spec using `tanh`."""
   means = (spec.maximum + spec.minimum) / 2.0
@@ -38,6 +54,54 @@ def tanh_squash_to_spec(inputs, spec):
   return means + magnitudes * tf.tanh(inputs)
 
 
+_distribution_spec_cache = {}
+
+
+def _normal_distribution_spec(sample_spec, scale_distribution):
+  """Returns a shared `DistributionSpec` for the given sample spec.
+
+  `DistributionSpec`s are immutable, so instances built from the same sample
+  spec and scaling mode are interchangeable; they are cached so that repeated
+  network construction (e.g. across a hyperparameter sweep) reuses one spec.
+  The cache is keyed on the spec's value -- shape, dtype, and bounds -- so
+  distinct but equal spec objects share a single entry, and the handful of
+  distinct action specs in a program keeps the cache small.
+
+  Args:
+    sample_spec: A `tensor_spec.BoundedTensorSpec` detailing the shape and
+      dtypes of samples pulled from the output distribution.
+    scale_distribution: Whether the built distributions are scaled to the
+      sample spec with a bijector chain.
+  """
+  key = (tuple(sample_spec.shape.as_list()), sample_spec.dtype,
+         scale_distribution,
+         np.asarray(sample_spec.minimum).tobytes(),
+         np.asarray(sample_spec.maximum).tobytes())
+  spec = _distribution_spec_cache.get(key)
+  if spec is not None:
+    return spec
+
+  input_param_shapes = _normal_param_static_shapes(
+      tuple(sample_spec.shape.as_list()))
+  input_param_spec = tf.nest.map_structure(
+      lambda tensor_shape: tensor_spec.TensorSpec(  # pylint: disable=g-long-lambda
+          shape=tensor_shape,
+          dtype=sample_spec.dtype),
+      input_param_shapes)
+
+  def distribution_builder(*args, **kwargs):
+    distribution = tfp.distributions.Normal(*args, **kwargs)
+    if scale_distribution:
+      return distribution_utils.scale_distribution_to_spec(
+          distribution, sample_spec)
+    return distribution
+
+  spec = distribution_spec.DistributionSpec(
+      distribution_builder, input_param_spec, sample_spec=sample_spec)
+  _distribution_spec_cache[key] = spec
+  return spec
+
+
 @gin.configurable
 class NormalProjectionNetwork(network.DistributionNetwork):
   """Generates a tfp.distribution.Normal by predicting a mean and std.
@@ -68,8 +132,8 @@ class NormalProjectionNetwork(network.DistributionNetwork):
       init_means_output_factor: Output factor for initializing action means
         weights.
       std_bias_initializer_value: Initial value for the bias of the
-        stddev_projection_layer or the direct bias_layer depending on the
-        state_dependent_std flag.
+        stddev_projection_layer or the direct std bias variable depending on
+        the state_dependent_std flag.
       mean_transform: Transform to apply to the calculated means. Uses
         `tanh_squash_to_spec` by default.
       std_transform: Transform to apply to the stddevs.
@@ -85,7 +149,7 @@ class NormalProjectionNetwork(network.DistributionNetwork):
       raise ValueError('Normal Projection network only supports single spec '
                        'samples.')
     self._scale_distribution = scale_distribution
-    output_spec = self._output_distribution_spec(sample_spec)
+    output_spec = _normal_distribution_spec(sample_spec, scale_distribution)
     super(NormalProjectionNetwork, self).__init__(
         # We don't need these, but base class requires them.
         input_tensor_spec=None,
@@ -94,52 +158,62 @@ class NormalProjectionNetwork(network.DistributionNetwork):
         name=name)
 
     self._sample_spec = sample_spec
+    # Cache the static shape info so the forward pass doesn't re-walk the
+    # TensorShape on every call.
+    self._sample_shape_list = sample_spec.shape.as_list()
+    self._sample_num_elements = sample_spec.shape.num_elements()
     self._mean_transform = mean_transform
+    if mean_transform is tanh_squash_to_spec:
+      # The default transform depends only on the fixed spec bounds, so
+      # capture the derived mean and magnitude as constants once instead of
+      # re-deriving them from the bounds on every call.
+      spec_means = tf.constant(
+          (sample_spec.maximum + sample_spec.minimum) / 2.0,
+          dtype=sample_spec.dtype)
+      spec_magnitudes = tf.constant(
+          (sample_spec.maximum - sample_spec.minimum) / 2.0,
+          dtype=sample_spec.dtype)
+      self._mean_transform = (
+          lambda inputs, _: spec_means + spec_magnitudes * tf.tanh(inputs))
     self._std_transform = std_transform
     self._state_dependent_std = state_dependent_std
 
-    self._means_projection_layer = tf.keras.layers.Dense(
-        sample_spec.shape.num_elements(),
-        activation=activation_fn,
-        kernel_initializer=tf.compat.v1.keras.initializers.VarianceScaling(
-            scale=init_means_output_factor),
-        bias_initializer=tf.keras.initializers.Zeros(),
-        name='means_projection_layer')
-
-    self._stddev_projection_layer = None
+    self._means_projection_layer = None
+    self._means_stddev_projection_layer = None
     if self._state_dependent_std:
-      self._stddev_projection_layer = tf.keras.layers.Dense(
-          sample_spec.shape.num_elements(),
+      # Project means and state-dependent stddevs with a single fused Dense
+      # layer; one matmul on the joined kernel is cheaper than two on the
+      # per-head kernels. The kernel initializer sees the same fan-in as two
+      # separate layers, and the bias initializer concatenates the zero means
+      # bias with the stddev bias, so the initialization matches.
+      self._means_stddev_projection_layer = tf.keras.layers.Dense(
+          2 * self._sample_num_elements,
           activation=activation_fn,
           kernel_initializer=tf.compat.v1.keras.initializers.VarianceScaling(
               scale=init_means_output_factor),
-          bias_initializer=tf.keras.initializers.Constant(
-              value=std_bias_initializer_value),
-          name='stddev_projection_layer')
+          bias_initializer=tf.compat.v1.initializers.constant(
+              [0.0] * self._sample_num_elements +
+              [std_bias_initializer_value] * self._sample_num_elements),
+          name='means_stddev_projection_layer')
     else:
-      self._bias = bias_layer.BiasLayer(
-          bias_initializer=tf.keras.initializers.Constant(
+      self._means_projection_layer = tf.keras.layers.Dense(
+          self._sample_num_elements,
+          activation=activation_fn,
+          kernel_initializer=tf.compat.v1.keras.initializers.VarianceScaling(
+              scale=init_means_output_factor),
+          bias_initializer=tf.keras.initializers.Zeros(),
+          name='means_projection_layer')
+      # A bare variable is all the input-independent std path needs; going
+      # through a Keras BiasLayer would add a layer call per forward pass.
+      # As with BiasLayer, there is one bias parameter per last dimension,
+      # and the dtype follows the spec so no cast is needed downstream.
+      self._std_bias = self.add_weight(
+          name='std_bias',
+          shape=[self._sample_shape_list[-1]],
+          dtype=sample_spec.dtype,
+          initializer=tf.keras.initializers.Constant(
               value=std_bias_initializer_value))
 
-  def _output_distribution_spec(self, sample_spec):
-    input_param_shapes = tfp.distributions.Normal.param_static_shapes(
-        sample_spec.shape)
-    input_param_spec = tf.nest.map_structure(
-        lambda tensor_shape: tensor_spec.TensorSpec(  # pylint: disable=g-long-lambda
-            shape=tensor_shape,
-            dtype=sample_spec.dtype),
-        input_param_shapes)
-
-    def distribution_builder(*args, **kwargs):
-      distribution = tfp.distributions.Normal(*args, **kwargs)
-      if self._scale_distribution:
-        return distribution_utils.scale_distribution_to_spec(
-            distribution, sample_spec)
-      return distribution
-
-    return distribution_spec.DistributionSpec(
-        distribution_builder, input_param_spec, sample_spec=sample_spec)
-
   def call(self, inputs, outer_rank):
     if inputs.dtype != self._sample_spec.dtype:
       raise ValueError(
@@ -147,28 +221,39 @@ class NormalProjectionNetwork(network.DistributionNetwork):
     # outer_rank is needed because the projection is not done on the raw
     # observations so getting the outer rank is hard as there is no spec to
     # compare to.
-    batch_squash = network_utils.BatchSquash(outer_rank)
-    inputs = batch_squash.flatten(inputs)
+    batch_squash = None
+    if outer_rank != 1:
+      batch_squash = network_utils.BatchSquash(outer_rank)
+      inputs = batch_squash.flatten(inputs)
 
-    means = self._means_projection_layer(inputs)
-    means = tf.reshape(means, [-1] + self._sample_spec.shape.as_list())
+    if self._state_dependent_std:
+      means, stds = tf.split(
+          self._means_stddev_projection_layer(inputs), 2, axis=-1)
+    else:
+      means = self._means_projection_layer(inputs)
+    means = tf.reshape(means, [-1] + self._sample_shape_list)
 
     # If scaling the distribution later, use a normalized mean.
     if not self._scale_distribution and self._mean_transform is not None:
       means = self._mean_transform(means, self._sample_spec)
-    means = tf.cast(means, self._sample_spec.dtype)
+    # Keras layer autocasting or a user-supplied transform can change the
+    # dtype, so cast back to the spec's dtype -- but only dispatch the op
+    # when it would actually do something.
+    if means.dtype != self._sample_spec.dtype:
+      means = tf.cast(means, self._sample_spec.dtype)
 
-    if self._state_dependent_std:
-      stds = self._stddev_projection_layer(inputs)
-    else:
-      stds = self._bias(tf.zeros_like(means))
-      stds = tf.reshape(stds, [-1] + self._sample_spec.shape.as_list())
+    if not self._state_dependent_std:
+      # The stddevs are input independent, so broadcast the bias variable to
+      # the means shape rather than materializing a zeros tensor to add it to.
+      stds = tf.broadcast_to(self._std_bias, tf.shape(means))
 
     if self._std_transform is not None:
       stds = self._std_transform(stds)
-    stds = tf.cast(stds, self._sample_spec.dtype)
+    if stds.dtype != self._sample_spec.dtype:
+      stds = tf.cast(stds, self._sample_spec.dtype)
 
-    means = batch_squash.unflatten(means)
-    stds = batch_squash.unflatten(stds)
+    if batch_squash is not None:
+      means = batch_squash.unflatten(means)
+      stds = batch_squash.unflatten(stds)
 
     return self.output_spec.build_distribution(loc=means, scale=stds)
@@ -76,10 +76,12 @@ class NormalProjectionNetworkTest(tf.test.TestCase):
     network(inputs, outer_rank=1)
     self.evaluate(tf.compat.v1.global_variables_initializer())
 
-    # Dense kernel, dense bias, std bias.
+    # Std bias, dense kernel, dense bias. The std bias is created directly on
+    # the network at construction time, so it precedes the dense layer's
+    # weights.
     self.assertEqual(3, len(network.trainable_variables))
-    self.assertEqual((5, 2), network.trainable_variables[0].shape)
-    self.assertEqual((2,), network.trainable_variables[1].shape)
+    self.assertEqual((2,), network.trainable_variables[0].shape)
+    self.assertEqual((5, 2), network.trainable_variables[1].shape)
     self.assertEqual((2,), network.trainable_variables[2].shape)
 
   def testTrainableVariablesStateDepStddev(self):
@@ -92,12 +94,10 @@ class NormalProjectionNetworkTest(tf.test.TestCase):
     network(inputs, outer_rank=1)
     self.evaluate(tf.compat.v1.global_variables_initializer())
 
-    # Dense kernel, dense bias, std bias.
-    self.assertEqual(4, len(network.trainable_variables))
-    self.assertEqual((5, 2), network.trainable_variables[0].shape)
-    self.assertEqual((2,), network.trainable_variables[1].shape)
-    self.assertEqual((5, 2), network.trainable_variables[2].shape)
-    self.assertEqual((2,), network.trainable_variables[3].shape)
+    # Fused means+stddev dense kernel and bias.
+    self.assertEqual(2, len(network.trainable_variables))
+    self.assertEqual((5, 4), network.trainable_variables[0].shape)
+    self.assertEqual((4,), network.trainable_variables[1].shape)
 
   def testScaledDistribution(self):
     output_spec = tensor_spec.BoundedTensorSpec([1], tf.float32, -2, 4)